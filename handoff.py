@@ -30,17 +30,33 @@ GitHub: https://github.com/Phant0mass/claude-chat-handoff
 License: MIT
 """
 
+import base64
+import hashlib
 import json
 import sys
 import os
+import pickle
 import re
+import http.client
+import urllib.parse
 import urllib.request
-import urllib.error
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 
+try:
+    import ijson  # Optional: streams very large exports instead of loading them whole
+except ImportError:
+    ijson = None
+
+try:
+    import orjson  # Optional: faster JSON parsing/serialization
+except ImportError:
+    orjson = None
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -48,25 +64,92 @@ SCRIPT_DIR = Path(__file__).parent.resolve()
 DEFAULT_INPUT_DIR = SCRIPT_DIR / "exports"
 DEFAULT_OUTPUT_DIR = SCRIPT_DIR / "handoffs"
 CONFIG_FILE = SCRIPT_DIR / "config.json"
+CACHE_DIR = DEFAULT_INPUT_DIR / ".cache"  # Parsed exports, reused while the JSON is unchanged
 
 # Defaults
 VERBATIM_MESSAGE_COUNT = 30
 SMART_MODEL = "claude-sonnet-4-20250514"
 SMART_MAX_TOKENS = 4096
 
+# Long conversations are summarized in chunks (map) by a smaller model, then merged (reduce)
+SMART_MAP_MODEL = "claude-haiku-4-5-20251001"
+SMART_MAP_MAX_TOKENS = 1024
+SUMMARY_CHUNK_CHARS = 40000
+SUMMARY_MAX_WORKERS = 4
+
+# Verbatim messages longer than this are truncated in the handoff
+VERBATIM_MAX_CHARS = 8000
+SENDER_LABELS = {'human': "**Human:**", 'assistant': "**Assistant:**"}
+
+# Exports at least this large are streamed message-by-message when ijson is installed
+STREAM_MIN_BYTES = 10 * 1024 * 1024
+
+# Bump when parsing/filtering output changes, so stale cached parses are ignored
+PARSE_CACHE_VERSION = 3
+
 # Noise patterns to filter from messages (Claude Code status, compaction notices, etc.)
+# Each pattern is matched at the start of a line; a matching line is dropped whole.
 NOISE_PATTERNS = [
-    r'^✶\s*Compacting conversation',
-    r'^✶\s*Churned for',
-    r'^✶\s*Sautéed for',
-    r'^✶\s*Brewed for',
-    r'^✶\s*Worked for',
-    r'^✶\s*Zigzagging',
-    r'^\s*⎿\s*☐',  # Checkbox items from CC status
-    r'^\s*⎿\s*☒',  # Checked items from CC status
-    r'^ctrl\+c to interrupt',
-    r'thinking\)$',
+    r'✶[^\S\n]*Compacting conversation',
+    r'✶[^\S\n]*Churned for',
+    r'✶[^\S\n]*Sautéed for',
+    r'✶[^\S\n]*Brewed for',
+    r'✶[^\S\n]*Worked for',
+    r'✶[^\S\n]*Zigzagging',
+    r'[^\S\n]*⎿[^\S\n]*☐',  # Checkbox items from CC status
+    r'[^\S\n]*⎿[^\S\n]*☒',  # Checked items from CC status
+    r'ctrl\+c to interrupt',
+    r'[^\n]*thinking\)$',
+]
+NOISE_RE = re.compile(
+    r'^(?:' + '|'.join(f'(?:{p})' for p in NOISE_PATTERNS) + r')[^\n]*\n?',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Substrings that mark a short message (< 100 chars) as pure status noise
+NOISE_INDICATORS = (
+    'Compacting conversation',
+    'ctrl+c to interrupt',
+    '⎿',  # CC status indicator
+    '✶',  # CC status indicator
+)
+
+# File path patterns for standard mode extraction, each paired with a literal
+# that any match must contain - str.find() rules out most text far faster than
+# the regex engine can, so a pattern only runs on content holding its literal
+FILE_PATH_PATTERNS = [
+    (':\\', r'[A-Za-z]:\\[^\s\'"<>|]+'),  # Windows paths
+    ('/', r'/[\w\-./]+\.\w+'),            # Unix paths with extension
+    ('src/', r'src/[\w\-./]+'),           # Common source paths
+    ('server/', r'server/[\w\-./]+'),
+    ('docs/', r'docs/[\w\-./]+'),
+    ('lib/', r'lib/[\w\-./]+'),
+    ('app/', r'app/[\w\-./]+'),
+    ('components/', r'components/[\w\-./]+'),
 ]
+# Compiled separately: the literal prefixes (src/, docs/, ...) each get re's fast
+# prefix scan, which a single alternation of all of them would lose
+FILE_PATH_RES = [(literal, re.compile(p)) for literal, p in FILE_PATH_PATTERNS]
+
+# Markers for lines worth keeping as decisions / key points in standard mode
+DECISION_MARKERS = [
+    r'(?:we|I) (?:decided|chose|will|should|need to)',
+    r'(?:the|our) pattern',
+    r'convention',
+    r'architecture',
+    r'migration',
+    r'IMPORTANT',
+    r'NOTE:',
+    r'TODO:',
+]
+DECISION_RE = re.compile('|'.join(f'(?:{m})' for m in DECISION_MARKERS), re.IGNORECASE)
+# Case-sensitive twin of DECISION_RE for casefolded text, used to skip whole messages
+# (~2x faster than IGNORECASE). casefold() maps every character IGNORECASE would match
+# to the marker's own letter, except Turkish İ/ı for 'i', which are allowed explicitly.
+# Markers must stay plain literals/groups (no escapes) for the casefold to be valid.
+DECISION_FOLDED_RE = re.compile(
+    '|'.join(f'(?:{m})' for m in DECISION_MARKERS).casefold().replace('i', '(?:i\u0307?|\u0131)')
+)
 
 
 def load_config():
@@ -84,41 +167,143 @@ def load_config():
 # JSON PARSING
 # ============================================================================
 
-def parse_json_export(filepath):
-    """Parse JSON export format from Claude.ai"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+@dataclass(slots=True)
+class Message:
+    """A filtered chat message (length is len(content), computed once)"""
+    sender: str
+    content: str
+    timestamp: str
+    length: int = field(init=False)
 
-    # Validate structure
-    if 'chat_messages' not in data and 'messages' not in data:
-        raise ValueError("Invalid JSON format: missing 'chat_messages' or 'messages' field")
+    def __post_init__(self):
+        self.length = len(self.content)
 
-    messages = []
-    raw_messages = data.get('chat_messages', data.get('messages', []))
 
-    for msg in raw_messages:
-        content = extract_content_from_json(msg)
+@dataclass(slots=True)
+class MessageBatch:
+    """Messages stored column-wise as parallel lists, with interned senders
 
-        # Skip empty messages
-        if not content.strip():
-            continue
+    Scans that need a single field (e.g. all contents) walk one flat list;
+    iterating or indexing the batch still yields Message rows.
+    """
+    senders: list = field(default_factory=list)
+    contents: list = field(default_factory=list)
+    timestamps: list = field(default_factory=list)
+    char_count: int = 0  # Running total of len(content), kept up to date by append()
 
-        # Filter noise from content
-        content = filter_noise(content)
+    def append(self, message):
+        self.senders.append(sys.intern(message.sender))
+        self.contents.append(message.content)
+        self.timestamps.append(message.timestamp)
+        self.char_count += message.length
 
-        # Skip if content became empty after filtering
-        if not content.strip():
-            continue
+    def total_chars(self):
+        return self.char_count
 
-        # Skip entire message if it's just noise
-        if is_noise_message(content):
-            continue
+    def __len__(self):
+        return len(self.contents)
+
+    def __iter__(self):
+        return map(Message, self.senders, self.contents, self.timestamps)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            contents = self.contents[index]
+            return MessageBatch(self.senders[index], contents, self.timestamps[index], sum(map(len, contents)))
+        return Message(self.senders[index], self.contents[index], self.timestamps[index])
+
+
+def json_loads(raw):
+    """Parse JSON bytes, using orjson when installed"""
+    if orjson:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # orjson is stricter (e.g. lone surrogates) - let json decide
+    return json.loads(raw)
+
+
+def json_dumps(obj):
+    """Serialize to UTF-8 JSON bytes, using orjson when installed"""
+    if orjson:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj).encode('utf-8')
+
+
+def export_cache_key(filepath):
+    """Key a cached parse to the export's path, size and modification time"""
+    stat = os.stat(filepath)
+    return (PARSE_CACHE_VERSION, str(Path(filepath).resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def prune_export_cache():
+    """Delete cached parses whose export was deleted or changed since caching"""
+    if not CACHE_DIR.is_dir():
+        return
+    for cache_path in CACHE_DIR.glob('*.p*'):
+        try:
+            with open(cache_path, 'rb') as f:
+                cache_key = pickle.load(f)
+            stale = cache_key != export_cache_key(cache_key[1])
+        except Exception:
+            stale = True  # Unreadable, old format, or the export is gone
+        if stale:
+            try:
+                cache_path.unlink()
+            except OSError:
+                pass
+
+
+def load_export(filepath):
+    """Parse a JSON export, reusing the cached parse if the file is unchanged"""
+    prune_export_cache()
+    cache_key = export_cache_key(filepath)
+    path_hash = hashlib.sha1(cache_key[1].encode('utf-8')).hexdigest()
+    cache_path = CACHE_DIR / f"{path_hash}.pkl"
+
+    try:
+        with open(cache_path, 'rb') as f:
+            if pickle.load(f) == cache_key:
+                return pickle.load(f)
+    except Exception:
+        pass  # No usable cache - parse from scratch
+
+    data = parse_json_export(filepath)
 
-        messages.append({
-            'sender': msg.get('sender', 'unknown'),
-            'content': content,
-            'timestamp': msg.get('created_at', '')[:19].replace('T', ' ')
-        })
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        partial_path = cache_path.with_suffix('.partial')
+        with open(partial_path, 'wb') as f:
+            pickle.dump(cache_key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(partial_path, cache_path)
+    except Exception:
+        pass  # Caching is best-effort
+
+    return data
+
+
+def parse_json_export(filepath):
+    """Parse JSON export format from Claude.ai"""
+    if ijson and os.path.getsize(filepath) >= STREAM_MIN_BYTES:
+        data, raw_messages = stream_json_export(filepath)
+    else:
+        with open(filepath, 'rb') as f:
+            data = json_loads(f.read())
+
+        # Validate structure
+        if 'chat_messages' not in data and 'messages' not in data:
+            raise ValueError("Invalid JSON format: missing 'chat_messages' or 'messages' field")
+
+        raw_messages = data.get('chat_messages', data.get('messages', []))
+
+    messages = MessageBatch()
+    for message in map(parse_message, raw_messages):
+        if message:
+            messages.append(message)
 
     return {
         'name': data.get('name', 'Unknown Chat'),
@@ -129,6 +314,61 @@ def parse_json_export(filepath):
     }
 
 
+def stream_json_export(filepath):
+    """Read export header fields, then stream raw messages one at a time (needs ijson)"""
+    header_fields = ('name', 'summary', 'created_at', 'updated_at')
+    header = {}
+    keys = set()
+
+    # First pass: top-level fields only - message bodies are skipped, not built
+    with open(filepath, 'rb') as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == '' and event == 'map_key':
+                keys.add(value)
+            elif prefix in header_fields and event == 'string':
+                header[prefix] = value
+            if 'chat_messages' in keys and len(header) == len(header_fields):
+                break
+
+    # Validate structure
+    if 'chat_messages' not in keys and 'messages' not in keys:
+        raise ValueError("Invalid JSON format: missing 'chat_messages' or 'messages' field")
+
+    messages_key = 'chat_messages' if 'chat_messages' in keys else 'messages'
+
+    def iter_messages():
+        with open(filepath, 'rb') as f:
+            yield from ijson.items(f, f'{messages_key}.item', use_float=True)
+
+    return header, iter_messages()
+
+
+def parse_message(msg):
+    """Turn a raw JSON message into a filtered Message, or None if nothing is left"""
+    content = extract_content_from_json(msg)
+
+    # Skip empty messages
+    if not content.strip():
+        return None
+
+    # Filter noise from content
+    content = filter_noise(content)
+
+    # Skip if content became empty after filtering
+    if not content.strip():
+        return None
+
+    # Skip entire message if it's just noise
+    if is_noise_message(content):
+        return None
+
+    return Message(
+        sender=msg.get('sender', 'unknown'),
+        content=content,
+        timestamp=msg.get('created_at', '')[:19].replace('T', ' ')
+    )
+
+
 def extract_content_from_json(msg):
     """Extract text content from JSON message"""
     content = msg.get('content', [])
@@ -148,20 +388,13 @@ def extract_content_from_json(msg):
 
 def filter_noise(content):
     """Filter out system noise from message content"""
-    lines = content.split('\n')
-    filtered_lines = []
-
-    for line in lines:
-        is_noise = False
-        for pattern in NOISE_PATTERNS:
-            if re.search(pattern, line, re.IGNORECASE):
-                is_noise = True
-                break
+    filtered = NOISE_RE.sub('', content)
 
-        if not is_noise:
-            filtered_lines.append(line)
+    # Dropping the last line leaves the newline before it behind
+    if filtered.endswith('\n') and not content.endswith('\n'):
+        filtered = filtered[:-1]
 
-    return '\n'.join(filtered_lines)
+    return filtered
 
 
 def is_noise_message(content):
@@ -169,18 +402,7 @@ def is_noise_message(content):
     content = content.strip()
 
     # Very short messages that are just status updates
-    if len(content) < 100:
-        noise_indicators = [
-            'Compacting conversation',
-            'ctrl+c to interrupt',
-            '⎿',  # CC status indicator
-            '✶',  # CC status indicator
-        ]
-        for indicator in noise_indicators:
-            if indicator in content:
-                return True
-
-    return False
+    return len(content) < 100 and any(indicator in content for indicator in NOISE_INDICATORS)
 
 
 # ============================================================================
@@ -194,52 +416,35 @@ def estimate_tokens(text_or_count):
     return len(text_or_count or '') // 4
 
 
-def extract_file_paths(text):
-    """Extract file paths mentioned in text"""
-    patterns = [
-        r'[A-Za-z]:\\[^\s\'"<>|]+',  # Windows paths
-        r'/[\w\-./]+\.\w+',           # Unix paths with extension
-        r'src/[\w\-./]+',             # Common source paths
-        r'server/[\w\-./]+',
-        r'docs/[\w\-./]+',
-        r'lib/[\w\-./]+',
-        r'app/[\w\-./]+',
-        r'components/[\w\-./]+',
-    ]
-
+def extract_file_paths(contents):
+    """Extract file paths mentioned in message contents"""
     paths = set()
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        paths.update(matches)
+    for content in contents:
+        if '/' not in content and ':\\' not in content:
+            continue
+        for literal, pattern in FILE_PATH_RES:
+            if literal in content:
+                paths.update(pattern.findall(content))
 
     filtered = [p for p in paths if len(p) > 5 and not p.startswith('//')]
     return sorted(filtered)
 
 
-def extract_decisions(text):
-    """Extract lines that look like decisions or key points"""
-    decision_markers = [
-        r'(?:we|I) (?:decided|chose|will|should|need to)',
-        r'(?:the|our) pattern',
-        r'convention',
-        r'architecture',
-        r'migration',
-        r'IMPORTANT',
-        r'NOTE:',
-        r'TODO:',
-    ]
-
+def extract_decisions(contents, limit=20):
+    """Extract lines from message contents that look like decisions or key points"""
     decisions = []
-    lines = text.split('\n')
-    for line in lines:
-        line = line.strip()
-        if len(line) > 20 and len(line) < 500:
-            for marker in decision_markers:
-                if re.search(marker, line, re.IGNORECASE):
-                    decisions.append(line)
-                    break
+    for content in contents:
+        # No marker spans a line break, so a message without one has no decision lines
+        if not DECISION_FOLDED_RE.search(content.casefold()):
+            continue
+        for line in content.split('\n'):
+            line = line.strip()
+            if len(line) > 20 and len(line) < 500 and DECISION_RE.search(line):
+                decisions.append(line)
+                if len(decisions) >= limit:
+                    return decisions
 
-    return decisions[:20]
+    return decisions
 
 
 # ============================================================================
@@ -247,94 +452,217 @@ def extract_decisions(text):
 # ============================================================================
 
 class Spinner:
-    """Simple CLI spinner for long-running operations"""
+    """Simple CLI spinner for long-running operations (plain status lines when not a TTY)"""
     def __init__(self, message="Working"):
         self.message = message
-        self.running = False
+        self.stopped = threading.Event()
         self.thread = None
 
     def _spin(self):
         chars = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
         i = 0
-        while self.running:
+        while True:
             print(f"\r  {chars[i % len(chars)]} {self.message}...", end="", flush=True)
-            time.sleep(0.1)
+            if self.stopped.wait(0.25):
+                break
             i += 1
         print(f"\r  ✓ {self.message}... done!     ")
 
     def start(self):
-        self.running = True
-        self.thread = threading.Thread(target=self._spin)
+        self.stopped.clear()
+        if not sys.stdout.isatty():
+            # No animation when piped/logged - just one line at start and end
+            print(f"  {self.message}...", flush=True)
+            return
+        self.thread = threading.Thread(target=self._spin, daemon=True)
         self.thread.start()
 
     def stop(self):
-        self.running = False
+        self.stopped.set()
         if self.thread:
             self.thread.join()
+            self.thread = None
+        else:
+            print(f"  ✓ {self.message}... done!")
+
+
+API_HOST = "api.anthropic.com"
+API_PATH = "/v1/messages"
+
+# One keep-alive connection per thread, so repeated (and concurrent map-step)
+# calls skip the TCP + TLS handshake after the first request
+api_connections = threading.local()
+
+
+def get_api_connection():
+    """Return this thread's HTTPS connection to the API, honouring an HTTPS proxy"""
+    conn = getattr(api_connections, 'conn', None)
+    if conn is None:
+        proxy = urllib.request.getproxies().get('https')
+        if proxy and not urllib.request.proxy_bypass(API_HOST):
+            if '://' not in proxy:
+                proxy = 'http://' + proxy  # Bare host:port, as urllib accepts
+            proxy_url = urllib.parse.urlsplit(proxy)
+            proxy_port = proxy_url.port or (443 if proxy_url.scheme == 'https' else 80)
+            tunnel_headers = {}
+            if proxy_url.username is not None:
+                credentials = (f"{urllib.parse.unquote(proxy_url.username)}:"
+                               f"{urllib.parse.unquote(proxy_url.password or '')}")
+                tunnel_headers['Proxy-Authorization'] = (
+                    "Basic " + base64.b64encode(credentials.encode('utf-8')).decode('ascii'))
+            conn = http.client.HTTPSConnection(proxy_url.hostname, proxy_port, timeout=120)
+            conn.set_tunnel(API_HOST, headers=tunnel_headers)
+        else:
+            conn = http.client.HTTPSConnection(API_HOST, timeout=120)
+        api_connections.conn = conn
+    return conn
+
 
+def close_api_connection():
+    """Drop this thread's API connection (a new one is opened on next use)"""
+    conn = getattr(api_connections, 'conn', None)
+    if conn is not None:
+        conn.close()
+        api_connections.conn = None
 
-def call_claude_api(api_key, prompt, model=SMART_MODEL, max_tokens=SMART_MAX_TOKENS):
-    """Call Claude API for smart summarization"""
-    url = "https://api.anthropic.com/v1/messages"
 
+def post_api_request(body, headers):
+    """POST to the Messages API on this thread's connection, returning (status, body)"""
+    while True:
+        reused = False
+        try:
+            conn = get_api_connection()
+            reused = conn.sock is not None
+            conn.request('POST', API_PATH, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            close_api_connection()
+            if not reused:
+                raise
+            # Server dropped the idle keep-alive connection - retry once on a fresh one
+        except Exception:
+            close_api_connection()
+            raise
+
+
+def call_claude_api(api_key, prompt, model=SMART_MODEL, max_tokens=SMART_MAX_TOKENS, context=None):
+    """Call Claude API for smart summarization
+
+    If given, context (the conversation text) is sent ahead of the prompt as a
+    cacheable block, so re-running on the same chat reuses the cached prefix.
+    """
     headers = {
         "Content-Type": "application/json",
         "x-api-key": api_key,
         "anthropic-version": "2023-06-01"
     }
 
+    content = prompt
+    if context:
+        content = [
+            {"type": "text", "text": context, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt}
+        ]
+
     data = {
         "model": model,
         "max_tokens": max_tokens,
         "messages": [
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": content}
         ]
     }
 
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(data).encode('utf-8'),
-        headers=headers,
-        method='POST'
-    )
-
     try:
-        with urllib.request.urlopen(req, timeout=120) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        status, response_body = post_api_request(json_dumps(data), headers)
+        if status == 200:
+            result = json_loads(response_body)
             return result['content'][0]['text']
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode('utf-8')
-        raise Exception(f"API Error {e.code}: {error_body}")
     except Exception as e:
         raise Exception(f"API call failed: {e}")
 
+    raise Exception(f"API Error {status}: {response_body.decode('utf-8', 'replace')}")
+
+
+def split_into_chunks(parts, max_chars):
+    """Group consecutive text parts into chunks of roughly max_chars each"""
+    chunks = []
+    current = []
+    current_len = 0
+    for part in parts:
+        if current and current_len + len(part) > max_chars:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_len = 0
+        current.append(part)
+        current_len += len(part) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def summarize_chunk(api_key, chunk, part, total_parts, model, max_tokens):
+    """Map step: summarize one part of a long conversation"""
+    context = f"""You are summarizing part {part} of {total_parts} of a development conversation. Your summary will be merged with summaries of the other parts into a handoff document for resuming work in a new chat session.
+
+CONVERSATION PART TO SUMMARIZE:
+{chunk}"""
+
+    prompt = """Summarize only this part as concise bullet points covering: what was accomplished, technical decisions and conventions adopted, files created or modified (paths), bugs and open TODOs, and specific details (variable names, patterns, gotchas) needed to continue the work."""
+
+    return call_claude_api(api_key, prompt, model, max_tokens, context=context)
+
 
 def generate_smart_summary(messages, api_key, config):
-    """Use Claude API to intelligently summarize older messages"""
+    """Use Claude API to intelligently summarize older messages
+
+    Short conversations are summarized in one call. Longer ones are split into
+    chunks that are summarized concurrently (map), then merged (reduce).
+    """
 
-    model = config.get('smart_mode', {}).get('model', SMART_MODEL)
-    max_tokens = config.get('smart_mode', {}).get('max_output_tokens', SMART_MAX_TOKENS)
+    smart_config = config.get('smart_mode', {})
+    model = smart_config.get('model', SMART_MODEL)
+    max_tokens = smart_config.get('max_output_tokens', SMART_MAX_TOKENS)
+    map_model = smart_config.get('map_model', SMART_MAP_MODEL)
 
     # Build conversation text for summarization
     conv_parts = []
-    for msg in messages:
-        sender = "Human" if msg['sender'] == 'human' else "Assistant"
-        content = msg['content'][:5000]  # Truncate very long messages
+    for sender, content in zip(messages.senders, messages.contents):
+        sender = "Human" if sender == 'human' else "Assistant"
+        content = content[:5000]  # Truncate very long messages
         conv_parts.append(f"[{sender}]: {content}")
 
-    conversation_text = "\n\n".join(conv_parts)
+    chunks = split_into_chunks(conv_parts, SUMMARY_CHUNK_CHARS)
+
+    spinner = Spinner("Calling Claude API for smart summarization")
+    spinner.start()
+    try:
+        if len(chunks) == 1:
+            intro = "You are analyzing a development conversation to create a handoff document for resuming work in a new chat session."
+            source = f"CONVERSATION TO ANALYZE:\n{chunks[0]}"
+        else:
+            def summarize_part(part, chunk):
+                return summarize_chunk(api_key, chunk, part, len(chunks), map_model, SMART_MAP_MAX_TOKENS)
 
-    # Truncate if still too long (with warning)
-    if len(conversation_text) > 350000:
-        print("  ⚠ Large conversation - truncating for API call")
-        conversation_text = conversation_text[:350000] + "\n\n[...truncated due to size...]"
+            with ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS) as executor:
+                partials = list(executor.map(summarize_part, range(1, len(chunks) + 1), chunks))
 
-    prompt = f"""You are analyzing a development conversation to create a handoff document for resuming work in a new chat session.
+            summaries_text = "\n\n".join(
+                f"### Part {part}\n{partial}" for part, partial in enumerate(partials, 1)
+            )
 
-CONVERSATION TO ANALYZE:
-{conversation_text}
+            # Truncate if still too long (with warning)
+            if len(summaries_text) > 350000:
+                print("\n  ⚠ Large conversation - truncating part summaries for API call")
+                summaries_text = summaries_text[:350000] + "\n\n[...truncated due to size...]"
 
-Create a structured summary with these sections:
+            intro = ("You are combining summaries of consecutive parts of a development conversation "
+                     "into one handoff document for resuming work in a new chat session.")
+            source = f"PART SUMMARIES (in conversation order):\n{summaries_text}"
+
+        context = f"{intro}\n\n{source}"
+
+        prompt = """Create a structured summary with these sections:
 
 ## Session Overview
 Brief 2-3 sentence summary of what was accomplished.
@@ -359,10 +687,7 @@ Any specific details (variable names, patterns, gotchas) that would be essential
 
 Be concise but complete. Focus on actionable information for resuming work."""
 
-    spinner = Spinner("Calling Claude API for smart summarization")
-    spinner.start()
-    try:
-        result = call_claude_api(api_key, prompt, model, max_tokens)
+        result = call_claude_api(api_key, prompt, model, max_tokens, context=context)
     finally:
         spinner.stop()
     return result
@@ -372,88 +697,108 @@ Be concise but complete. Focus on actionable information for resuming work."""
 # HANDOFF GENERATION
 # ============================================================================
 
-def generate_handoff_standard(data):
-    """Generate handoff using algorithmic approach (offline fallback)"""
+HANDOFF_FOOTER = """---
+
+## Resumption Instructions
+
+1. Share this handoff document with Claude in a new chat
+2. Reference any relevant project documentation
+3. Specify which aspect of the work to continue
+"""
+
+
+def write_verbatim_messages(out, messages):
+    """Write messages in full (truncating very long ones), one block per message"""
+    for msg in messages:
+        sender_label = SENDER_LABELS.get(msg.sender, "**Assistant:**")
+        content = msg.content
+        if msg.length > VERBATIM_MAX_CHARS:
+            content = content[:VERBATIM_MAX_CHARS] + f"\n\n*[Truncated - original was {msg.length:,} chars]*"
+        out.write(f"""### {sender_label} ({msg.timestamp})
+
+{content}
+
+""")
+
+
+def truncated_remainders(contents):
+    """Yield the part of each content that write_verbatim_messages would cut off
+
+    Starts at the beginning of the line holding the cut, so a path or decision
+    line straddling it is still seen whole.
+    """
+    for content in contents:
+        if len(content) > VERBATIM_MAX_CHARS:
+            yield content[content.rfind('\n', 0, VERBATIM_MAX_CHARS) + 1:]
+
+
+def generate_handoff_standard(data, out, total_chars):
+    """Write handoff to out using algorithmic approach (offline fallback)"""
 
     messages = data['messages']
-    all_text = '\n'.join(m['content'] for m in messages)
-    file_paths = extract_file_paths(all_text)
-    decisions = extract_decisions(all_text)
 
-    lines = []
+    # The verbatim tail is printed below, so only scan the messages before it -
+    # plus whatever of each tail message gets cut off by truncation
+    scan_count = len(messages) - VERBATIM_MESSAGE_COUNT
+    if scan_count <= 0:
+        scan_count = len(messages)
+    scan_contents = list(islice(messages.contents, scan_count))
+    scan_contents.extend(truncated_remainders(messages.contents[scan_count:]))
+    file_paths = extract_file_paths(scan_contents)
+    decisions = extract_decisions(scan_contents)
+
+    w = out.write
 
     # Header
-    lines.append(f"# Handoff: {data['name']}")
-    lines.append("")
-    lines.append(f"**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    lines.append(f"**Mode:** Standard (algorithmic - offline)")
-    lines.append(f"**Original Chat Period:** {data['created']} to {data['updated']}")
-    lines.append(f"**Message Count:** {len(messages)}")
-    lines.append(f"**Estimated Tokens:** ~{estimate_tokens(all_text):,}")
-    lines.append("")
+    w(f"""# Handoff: {data['name']}
+
+**Generated:** {datetime.now():%Y-%m-%d %H:%M}
+**Mode:** Standard (algorithmic - offline)
+**Original Chat Period:** {data['created']} to {data['updated']}
+**Message Count:** {len(messages)}
+**Estimated Tokens:** ~{estimate_tokens(total_chars):,}
+
+""")
 
     # Claude.ai's built-in summary (if available)
     if data['summary']:
-        lines.append("## Quick Context (Claude.ai Auto-generated)")
-        lines.append("")
-        lines.append(data['summary'])
-        lines.append("")
+        w(f"""## Quick Context (Claude.ai Auto-generated)
+
+{data['summary']}
+
+""")
 
     # Files
     if file_paths:
-        lines.append("## Files Referenced")
-        lines.append("")
-        for path in file_paths[:30]:
-            lines.append(f"- `{path}`")
-        lines.append("")
+        w("## Files Referenced\n\n")
+        w("".join(f"- `{path}`\n" for path in file_paths[:30]))
+        w("\n")
 
     # Decisions
     if decisions:
-        lines.append("## Key Decisions & Patterns")
-        lines.append("")
-        for decision in decisions:
-            lines.append(f"- {decision.strip()}")
-        lines.append("")
+        w("## Key Decisions & Patterns\n\n")
+        w("".join(f"- {decision.strip()}\n" for decision in decisions))
+        w("\n")
 
     # Recent messages
-    lines.append("## Recent Conversation (Verbatim)")
-    lines.append("")
-    lines.append(f"*Last {min(VERBATIM_MESSAGE_COUNT, len(messages))} messages preserved:*")
-    lines.append("")
-
-    for msg in messages[-VERBATIM_MESSAGE_COUNT:]:
-        sender_label = "**Human:**" if msg['sender'] == 'human' else "**Assistant:**"
-        lines.append(f"### {sender_label} ({msg['timestamp']})")
-        lines.append("")
-        content = msg['content']
-        if len(content) > 8000:
-            content = content[:8000] + f"\n\n*[Truncated - original was {len(msg['content']):,} chars]*"
-        lines.append(content)
-        lines.append("")
-
-    # Footer
-    lines.append("---")
-    lines.append("")
-    lines.append("## Resumption Instructions")
-    lines.append("")
-    lines.append("1. Share this handoff document with Claude in a new chat")
-    lines.append("2. Reference any relevant project documentation")
-    lines.append("3. Specify which aspect of the work to continue")
-    lines.append("")
-
-    return '\n'.join(lines)
-
-
-def generate_handoff_smart(data, api_key, config):
-    """Generate handoff using AI-powered summarization (default)"""
+    w(f"""## Recent Conversation (Verbatim)
+
+*Last {min(VERBATIM_MESSAGE_COUNT, len(messages))} messages preserved:*
+
+""")
+    write_verbatim_messages(out, messages[-VERBATIM_MESSAGE_COUNT:])
+
+    w(HANDOFF_FOOTER)
+
+
+def generate_handoff_smart(data, out, api_key, config, total_chars):
+    """Write handoff to out using AI-powered summarization (default)"""
 
     messages = data['messages']
     verbatim_count = config.get('smart_mode', {}).get('verbatim_recent_messages', VERBATIM_MESSAGE_COUNT)
 
-    total_chars = sum(len(m['content']) for m in messages)
-
     # Split: older messages for AI summary, recent messages verbatim
-    older_messages = messages[:-verbatim_count] if len(messages) > verbatim_count else []
+    older_messages = messages[:-verbatim_count] if len(messages) > verbatim_count else MessageBatch()
     recent_messages = messages[-verbatim_count:]
 
     # Get AI summary of older messages
@@ -461,60 +806,45 @@ def generate_handoff_smart(data, api_key, config):
     if older_messages:
         ai_summary = generate_smart_summary(older_messages, api_key, config)
 
-    # Build handoff
-    lines = []
+    # Write handoff
+    w = out.write
 
     # Header
-    lines.append(f"# Handoff: {data['name']}")
-    lines.append("")
-    lines.append(f"**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    lines.append(f"**Mode:** Smart (AI-summarized)")
-    lines.append(f"**Original Chat Period:** {data['created']} to {data['updated']}")
-    lines.append(f"**Message Count:** {len(messages)} ({len(older_messages)} summarized, {len(recent_messages)} verbatim)")
-    lines.append(f"**Original Size:** ~{estimate_tokens(total_chars):,} tokens")
-    lines.append("")
+    w(f"""# Handoff: {data['name']}
+
+**Generated:** {datetime.now():%Y-%m-%d %H:%M}
+**Mode:** Smart (AI-summarized)
+**Original Chat Period:** {data['created']} to {data['updated']}
+**Message Count:** {len(messages)} ({len(older_messages)} summarized, {len(recent_messages)} verbatim)
+**Original Size:** ~{estimate_tokens(total_chars):,} tokens
+
+""")
 
     # Claude.ai's built-in summary (if available) - this is gold from JSON exports
     if data['summary']:
-        lines.append("## Quick Context (Claude.ai Auto-generated)")
-        lines.append("")
-        lines.append(data['summary'])
-        lines.append("")
+        w(f"""## Quick Context (Claude.ai Auto-generated)
+
+{data['summary']}
+
+""")
 
     # AI Summary
     if ai_summary:
-        lines.append("## AI-Summarized Earlier Content")
-        lines.append("")
-        lines.append(ai_summary)
-        lines.append("")
+        w(f"""## AI-Summarized Earlier Content
+
+{ai_summary}
+
+""")
 
     # Recent messages verbatim
-    lines.append("## Recent Conversation (Verbatim)")
-    lines.append("")
-    lines.append(f"*Last {len(recent_messages)} messages preserved for immediate context:*")
-    lines.append("")
-
-    for msg in recent_messages:
-        sender_label = "**Human:**" if msg['sender'] == 'human' else "**Assistant:**"
-        lines.append(f"### {sender_label} ({msg['timestamp']})")
-        lines.append("")
-        content = msg['content']
-        if len(content) > 8000:
-            content = content[:8000] + f"\n\n*[Truncated - original was {len(msg['content']):,} chars]*"
-        lines.append(content)
-        lines.append("")
-
-    # Footer
-    lines.append("---")
-    lines.append("")
-    lines.append("## Resumption Instructions")
-    lines.append("")
-    lines.append("1. Share this handoff document with Claude in a new chat")
-    lines.append("2. Reference any relevant project documentation")
-    lines.append("3. Specify which aspect of the work to continue")
-    lines.append("")
-
-    return '\n'.join(lines)
+    w(f"""## Recent Conversation (Verbatim)
+
+*Last {len(recent_messages)} messages preserved for immediate context:*
+
+""")
+    write_verbatim_messages(out, recent_messages)
+
+    w(HANDOFF_FOOTER)
 
 
 # ============================================================================
@@ -657,12 +987,12 @@ def main():
     # Parse JSON
     print("\nParsing JSON export...")
     try:
-        data = parse_json_export(input_path)
+        data = load_export(input_path)
     except ValueError as e:
         print(f"  ERROR: {e}")
         sys.exit(1)
 
-    total_chars = sum(len(m['content']) for m in data['messages'])
+    total_chars = data['messages'].total_chars()
     total_tokens = estimate_tokens(total_chars)
 
     print(f"  Chat name: {data['name']}")
@@ -680,12 +1010,6 @@ def main():
     print()
     print("Generating handoff...")
 
-    if mode == 'smart':
-        api_key = config.get('anthropic_api_key', '')
-        handoff_content = generate_handoff_smart(data, api_key, config)
-    else:
-        handoff_content = generate_handoff_standard(data)
-
     # Create output filename
     safe_name = re.sub(r'[^\w\s\-]', '', data['name'])
     safe_name = re.sub(r'\s+', '-', safe_name).lower()[:50]
@@ -694,14 +1018,23 @@ def main():
     output_filename = f"{date_str}-handoff-{safe_name}{mode_suffix}.md"
 
     output_path = DEFAULT_OUTPUT_DIR / output_filename
+    partial_path = output_path.with_name(output_filename + '.partial')
 
-    # Save
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(handoff_content)
+    # Write straight to disk; only replace the output once the handoff is complete
+    try:
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            if mode == 'smart':
+                api_key = config.get('anthropic_api_key', '')
+                generate_handoff_smart(data, f, api_key, config, total_chars)
+            else:
+                generate_handoff_standard(data, f, total_chars)
+            output_size = f.tell()
+        os.replace(partial_path, output_path)
+    finally:
+        partial_path.unlink(missing_ok=True)
 
     # Calculate compression ratio
     input_size = input_path.stat().st_size
-    output_size = len(handoff_content.encode('utf-8'))
     compression = (1 - output_size / input_size) * 100 if input_size > 0 else 0
 
     # Done